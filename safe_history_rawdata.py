@@ -5,81 +5,286 @@ safe_tx_history.py  –  fast, API-only Safe history (+optional RPC details)
 Usage
 -----
 python safe_tx_history.py SAFE_ADDR RPC_URL              \
-        [--from-block N] [--fetch-chain] [--outfile out.csv]
+        [--from-block N] [--fetch-chain] [--outfile out.csv] [--no-cache]
 
 • SAFE_ADDR   – multisig address (any checksum / lower-case form)
 • RPC_URL     – only needed when --fetch-chain is present
+• service results are cached in ~/.cache/safe-stats/; reruns only fetch
+  txs above the last executed nonce
 """
 
 from __future__ import annotations
-import argparse, csv, sys, time
+import argparse, csv, math, sqlite3, sys, time
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
 from pathlib import Path
-from typing   import Any, Dict, List, Optional
+from typing   import Any, Iterable, Iterator, List, Optional
 
+try:
+    from orjson import dumps as json_dumps, loads as json_loads   # ~2× faster, bytes in/out
+except ImportError:
+    from json import dumps as json_dumps, loads as json_loads
 import requests
-from eth_utils import from_wei
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 from web3      import Web3
 from web3.types import TxData, TxReceipt
 
 BASE_URL = "https://safe-transaction-mainnet.safe.global"      # ← main-net
+NETWORK  = "mainnet"                                            # cache file prefix
+CACHE_DIR   = Path.home() / ".cache" / "safe-stats"
+PAGE_LIMIT  = 100                                               # service max
+MAX_WORKERS = 8                                                 # parallel page GETs
+RPC_BATCH   = 50                                                # txs per JSON-RPC batch
+RPC_WORKERS = 16                                                # parallel per-tx RPC calls
+
+# CSV column order – rows are plain tuples in exactly this order
+SERVICE_FIELDS = ("block", "nonce", "submission", "execution", "executor", "to",
+                  "value_eth", "operation", "safeTxGas", "data", "decoded", "tx_hash")
+RPC_FIELDS     = ("gas_price_gwei", "gas_used", "fee_eth", "input_data")
+FIELDS         = SERVICE_FIELDS + RPC_FIELDS
+BLOCK          = FIELDS.index("block")
+TX_HASH        = FIELDS.index("tx_hash")
+FEE_ETH        = FIELDS.index("fee_eth")
+NO_RPC         = ("",) * len(RPC_FIELDS)             # rpc-miss filler
+
+# one pooled keep-alive session for every service / RPC call (no per-request TLS handshake)
+_SESSION = requests.Session()
+_ADAPTER = HTTPAdapter(
+    pool_connections=16, pool_maxsize=max(16, RPC_WORKERS),
+    # raise_on_status=False: after the last retry hand the response back to
+    # fetch_service's own wait-and-retry loop instead of raising RetryError
+    max_retries=Retry(total=5, backoff_factor=0.3, status_forcelist=[502, 503, 504],
+                      raise_on_status=False),
+)
+_SESSION.mount("https://", _ADAPTER)
+_SESSION.mount("http://", _ADAPTER)                 # local RPC nodes
+_SESSION.headers.update({"Accept-Encoding": "gzip, deflate", "Connection": "keep-alive"})
 
 def fetch_service(url: str) -> dict[str, Any]:
     while True:
-        resp = requests.get(url, timeout=30)
+        resp = _SESSION.get(url, timeout=30)
         if resp.ok:
-            return resp.json()
+            return json_loads(resp.content)
         print(f"⚠️  {resp.status_code} {resp.reason} – retrying in 3 s", file=sys.stderr)
         time.sleep(3)
 
-def all_multisig_txs(safe: str) -> List[dict[str, Any]]:
-    out: list[dict[str, Any]] = []
-    url = f"{BASE_URL}/api/v1/safes/{safe}/multisig-transactions/?limit=100"
-    while url:
-        page = fetch_service(url)
-        out.extend(page["results"])
-        url = page["next"]
+def all_multisig_txs(safe: str, nonce_gte: Optional[int] = None) -> Iterator[dict[str, Any]]:
+    """Yield txs page by page (service order: nonce descending) as pages land."""
+    url   = f"{BASE_URL}/api/v1/safes/{safe}/multisig-transactions/?limit={PAGE_LIMIT}"
+    if nonce_gte is not None:
+        url += f"&nonce__gte={nonce_gte}"
+    first = fetch_service(url)
+    yield from first["results"]
+
+    # `count` tells us every page offset up front → fan the rest out in parallel
+    count = first.get("count")
+    if count is not None:
+        print(f"   → {count:,} multisig-transactions from service")
+    else:                               # no count reported – follow the cursor
+        nxt = first["next"]
+        while nxt:
+            page = fetch_service(nxt)
+            yield from page["results"]
+            nxt = page["next"]
+        return
+
+    urls = [f"{url}&offset={n * PAGE_LIMIT}" for n in range(1, math.ceil(count / PAGE_LIMIT))]
+    with ThreadPoolExecutor(max_workers=MAX_WORKERS) as ex:
+        for page in ex.map(fetch_service, urls):        # map keeps offset order
+            yield from page["results"]
+
+class TxCache:
+    """SQLite copy of a Safe's service history, one row per safeTxHash.
+
+    Once a nonce is executed nothing at or below it can change, so a rerun
+    only needs the txs from `resume_nonce()` upwards. Shared with
+    safe_stats_compat.py, which imports it from here.
+    """
+    def __init__(self, network: str, safe: str):
+        CACHE_DIR.mkdir(parents=True, exist_ok=True)
+        self.db = sqlite3.connect(CACHE_DIR / f"{network}-{safe}.db")
+        self.db.execute("CREATE TABLE IF NOT EXISTS txs (safe_tx_hash TEXT PRIMARY KEY,"
+                        " nonce INTEGER NOT NULL, executed INTEGER NOT NULL, json BLOB NOT NULL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS txs_nonce ON txs (nonce)")
+
+    def resume_nonce(self) -> Optional[int]:
+        (last,) = self.db.execute("SELECT MAX(nonce) FROM txs WHERE executed").fetchone()
+        return None if last is None else last + 1
+
+    def sync(self, fresh: Iterable[dict[str, Any]], nonce_gte: Optional[int]) -> Iterator[dict[str, Any]]:
+        """Yield the whole history, nonce descending, storing `fresh` on the way.
+
+        `fresh` (the service's txs from `nonce_gte` up) replaces that part of the
+        cache and is passed through as it arrives; the cached txs below follow.
+        Nothing is committed unless `fresh` is consumed to the end.
+        """
+        self.db.execute("DELETE FROM txs WHERE nonce >= ?", (nonce_gte or 0,))
+        for t in fresh:
+            self.db.execute("INSERT OR REPLACE INTO txs VALUES (?, ?, ?, ?)",
+                            (t["safeTxHash"], t["nonce"], bool(t["isExecuted"]), json_dumps(t)))
+            yield t
+        self.db.commit()
+        if nonce_gte is None:
+            return
+        for (blob,) in self.db.execute("SELECT json FROM txs WHERE nonce < ? ORDER BY nonce DESC",
+                                       (nonce_gte,)):
+            yield json_loads(blob)
+
+def _rpc_cols(chain_tx: TxData, receipt: Any) -> tuple[Any, ...]:
+    return (
+        round(chain_tx["gasPrice"] / 1e9, 3),                         # gas_price_gwei
+        receipt["gasUsed"],                                           # gas_used
+        round(receipt["gasUsed"] * chain_tx["gasPrice"] / 1e18, 6),   # fee_eth
+        chain_tx["input"],                                            # input_data
+    )
+
+# same eth tx can back several safe txs → memoise per (provider, hash)
+@lru_cache(maxsize=4096)
+def _get_tx(w3: Web3, h: str) -> TxData:
+    return w3.eth.get_transaction(h)
+
+@lru_cache(maxsize=4096)
+def _get_receipt(w3: Web3, h: str) -> TxReceipt:
+    return w3.eth.get_transaction_receipt(h)
+
+def _fetch_one(w3: Web3, h: str, receipt: Optional[Any] = None) -> Optional[tuple[TxData, Any]]:
+    try:
+        return _get_tx(w3, h), receipt or _get_receipt(w3, h)
+    except Exception as err:          # noqa: BLE001
+        print(f"⚠️  {h[:10]}… rpc-miss – {err}", file=sys.stderr)
+        return None
+
+# provider → does it answer eth_getBlockReceipts? (learnt from the first real call)
+_BLOCK_RECEIPTS_OK: dict[Web3, bool] = {}
+
+def _block_receipts(w3: Web3, todo: dict[str, Optional[int]]) -> dict[str, dict[str, Any]]:
+    """Receipts for `todo` (hash → block) in blocks holding two or more of its txs.
+
+    One eth_getBlockReceipts call pulls every receipt of the block, so it only
+    pays off when it replaces several eth_getTransactionReceipt batch entries;
+    lone txs keep riding in the batch.
+    """
+    by_block: dict[int, dict[str, str]] = {}
+    for h, bn in todo.items():
+        if bn is not None:
+            by_block.setdefault(bn, {})[h.lower()] = h
+    shared = [bn for bn, want in by_block.items() if len(want) > 1]
+    if not shared or _BLOCK_RECEIPTS_OK.get(w3) is False:
+        return {}
+
+    def get(bn: int) -> Optional[list[dict[str, Any]]]:
+        try:
+            resp = w3.provider.make_request("eth_getBlockReceipts", [hex(bn)])
+        except Exception:             # noqa: BLE001 – those txs fall back to per-tx receipts
+            return None
+        return None if "error" in resp else resp.get("result") or []
+
+    results: dict[int, Optional[list[dict[str, Any]]]] = {}
+    if w3 not in _BLOCK_RECEIPTS_OK:      # first use doubles as the support probe
+        results[shared[0]] = get(shared[0])
+        _BLOCK_RECEIPTS_OK[w3] = results[shared[0]] is not None
+        if not _BLOCK_RECEIPTS_OK[w3]:
+            return {}
+    rest = [bn for bn in shared if bn not in results]
+    with ThreadPoolExecutor(max_workers=RPC_WORKERS) as ex:
+        results.update(zip(rest, ex.map(get, rest)))
+
+    out: dict[str, dict[str, Any]] = {}
+    for bn, receipts in results.items():
+        want = by_block[bn]
+        for r in receipts or ():
+            h = want.get(r["transactionHash"].lower())
+            if h:
+                out[h] = {"gasUsed": int(r["gasUsed"], 16)}     # raw JSON-RPC → hex
+    return out
+
+def fetch_rpc(todo: dict[str, Optional[int]], w3: Web3) -> dict[str, tuple[Any, ...]]:
+    """RPC_FIELDS per tx hash in `todo` (hash → block), RPC_BATCH txs per HTTP round trip.
+
+    Blocks holding several of the txs get their receipts via eth_getBlockReceipts
+    where the provider has it; every other receipt rides along in the batch as
+    eth_getTransactionReceipt.
+    """
+    receipts = _block_receipts(w3, todo)
+    hashes = list(todo)
+    out: dict[str, tuple[Any, ...]] = {}
+    for i in range(0, len(hashes), RPC_BATCH):
+        chunk = hashes[i:i + RPC_BATCH]
+        try:
+            with w3.batch_requests() as batch:
+                for h in chunk:
+                    batch.add(w3.eth.get_transaction(h))
+                    if h not in receipts:
+                        batch.add(w3.eth.get_transaction_receipt(h))
+                res = iter(batch.execute())
+        except Exception:                 # noqa: BLE001 – no batch support / one miss sinks the batch
+            with ThreadPoolExecutor(max_workers=RPC_WORKERS) as ex:
+                for h, hit in zip(chunk, ex.map(lambda h: _fetch_one(w3, h, receipts.get(h)), chunk)):
+                    if hit:
+                        out[h] = _rpc_cols(*hit)
+            continue
+        for h in chunk:
+            chain_tx = next(res)
+            out[h] = _rpc_cols(chain_tx, receipts[h] if h in receipts else next(res))
     return out
 
+def _enriched(
+    rows: List[tuple[Any, ...]],
+    w3: Web3,
+    seen: dict[str, tuple[Any, ...]],
+) -> Iterator[tuple[Any, ...]]:
+    """Append RPC_FIELDS to `rows`; `seen` carries results (and misses) across calls."""
+    # only mined rows carry a real transactionHash; pending / rejected ones fall
+    # back to their safeTxHash, which is never on chain and would sink the batch
+    todo = {r[TX_HASH]: r[BLOCK] for r in rows
+            if r[TX_HASH] and r[BLOCK] is not None and r[TX_HASH] not in seen}
+    if todo:
+        seen.update(dict.fromkeys(todo, NO_RPC))
+        seen.update(fetch_rpc(todo, w3))
+    for r in rows:
+        yield r + seen.get(r[TX_HASH], NO_RPC)
+
 def build_rows(
-    txs: list[dict[str, Any]],
+    txs: Iterable[dict[str, Any]],
     from_blk: int,
     w3: Optional[Web3] = None
-) -> List[Dict[str, Any]]:
-    rows: list[Dict[str, Any]] = []
+) -> Iterator[tuple[Any, ...]]:
+    """Yield CSV rows in FIELDS order (SERVICE_FIELDS only when `w3` is None).
+
+    With `w3` rows are held back RPC_BATCH at a time for enrichment.
+    """
+    pending: list[tuple[Any, ...]] = []
+    seen: dict[str, tuple[Any, ...]] = {}       # tx hash → RPC_FIELDS for this run
     for t in txs:
         if t["blockNumber"] and t["blockNumber"] < from_blk:
             continue
-        row: Dict[str, Any] = {
-            "block":      t.get("blockNumber"),
-            "nonce":      t["nonce"],
-            "submission": t["submissionDate"],
-            "execution":  t.get("executionDate") or t.get("executedAt"),
-            "executor":   t.get("executor") or "",
-            "to":         t["to"],
-            "value_eth":  float(from_wei(int(t["value"]), "ether")),
-            "operation":  t["operation"],
-            "safeTxGas":  t["safeTxGas"],
-            "data":       t["data"] or "",
-            "decoded":    (t["dataDecoded"] or {}).get("method", ""),
-            "tx_hash":    t.get("transactionHash") or t.get("safeTxHash"),
-        }
+        row = (
+            t.get("blockNumber"),
+            t["nonce"],
+            t["submissionDate"],
+            t.get("executionDate") or t.get("executedAt"),
+            t.get("executor") or "",
+            t["to"],
+            int(t["value"]) / 10**18,
+            t["operation"],
+            t["safeTxGas"],
+            t["data"] or "",
+            (t["dataDecoded"] or {}).get("method", ""),
+            t.get("transactionHash") or t.get("safeTxHash"),
+        )
+        if not w3:
+            yield row
+            continue
 
         # ── optional RPC enrichment ───────────────────────────────────────
-        if w3 and row["tx_hash"]:
-            try:
-                chain_tx : TxData    = w3.eth.get_transaction(row["tx_hash"])
-                receipt  : TxReceipt = w3.eth.get_transaction_receipt(row["tx_hash"])
-                row.update(
-                    gas_price_gwei = round(chain_tx["gasPrice"] / 1e9, 3),
-                    gas_used       = receipt["gasUsed"],
-                    fee_eth        = round(receipt["gasUsed"] * chain_tx["gasPrice"] / 1e18, 6),
-                    input_data     = chain_tx["input"],
-                )
-            except Exception as err:          # noqa: BLE001
-                print(f"⚠️  {row['tx_hash'][:10]}… rpc-miss – {err}", file=sys.stderr)
-
-        rows.append(row)
-    return rows
+        pending.append(row)
+        if len(pending) == RPC_BATCH:
+            yield from _enriched(pending, w3, seen)
+            pending = []
+
+    if pending:
+        yield from _enriched(pending, w3, seen)
 
 # ─── CLI ─────────────────────────────────────────────────────────────────────
 def parse() -> argparse.Namespace:
@@ -90,6 +295,8 @@ def parse() -> argparse.Namespace:
     p.add_argument("--fetch-chain", action="store_true",
                    help="enrich with gasPrice/gasUsed via RPC (slower)")
     p.add_argument("--outfile")
+    p.add_argument("--no-cache", action="store_true",
+                   help="ignore the on-disk service cache and fetch everything")
     return p.parse_args()
 
 def main() -> None:
@@ -97,24 +304,36 @@ def main() -> None:
     safe  = Web3.to_checksum_address(args.safe)
     print(f"🔎 Fetching history for Safe {safe}")
 
-    txs   = all_multisig_txs(safe)
-    print(f"   → {len(txs):,} multisig-transactions from service")
-
     w3: Optional[Web3] = None
     if args.fetch_chain:
-        w3 = Web3(Web3.HTTPProvider(args.rpc_url))
+        w3 = Web3(Web3.HTTPProvider(args.rpc_url, session=_SESSION))
         if not w3.is_connected():
             sys.exit("❌  cannot reach RPC – aborting enrichment")
 
+    txs: Iterable[dict[str, Any]]
+    if args.no_cache:
+        txs = all_multisig_txs(safe)
+    else:
+        cache = TxCache(NETWORK, safe)
+        since = cache.resume_nonce()
+        if since is not None:
+            print(f"   → cached history up to nonce {since - 1:,}, fetching the rest")
+        txs = cache.sync(all_multisig_txs(safe, since), since)
+
     rows  = build_rows(txs, args.from_block, w3)
 
     out   = Path(args.outfile or f"safe-{safe.lower()}-tx.csv")
+    n, gas = 0, 0.0
     with out.open("w", newline="") as fp:
-        writer = csv.DictWriter(fp, fieldnames=rows[0].keys())
-        writer.writeheader(); writer.writerows(rows)
+        writer = csv.writer(fp)
+        writer.writerow(FIELDS if w3 else SERVICE_FIELDS)
+        for row in rows:
+            writer.writerow(row)
+            n += 1
+            if w3:
+                gas += row[FEE_ETH] or 0
 
-    gas = sum(r.get("fee_eth", 0) for r in rows)
-    print(f"✅  wrote {len(rows):,} rows → {out}   total gas (rpc) ≈ {gas:.4f} ETH")
+    print(f"✅  wrote {n:,} rows → {out}   total gas (rpc) ≈ {gas:.4f} ETH")
 
 if __name__ == "__main__":
     main()
@@ -1,9 +1,20 @@
 #!/usr/bin/env python3
+import functools
+import hashlib
+import io
+import math
+import os
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor
 from decimal import Decimal
-from statistics import mean, median, stdev
-from typing import Any, Dict, List, Sequence
-from eth_utils.currency import from_wei
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Sequence
+import numpy as np
+try:
+    from orjson import dumps as json_dumps, loads as json_loads
+except ImportError:
+    from json import dumps as json_dumps, loads as json_loads
 try:
     from safe_eth.eth import EthereumClient
     try:
@@ -15,59 +26,100 @@ except ImportError:
     from gnosis.eth import EthereumClient
     from gnosis.safe.api.transaction_service_api import TransactionServiceApi
     from gnosis.safe import Safe
-from maya import MayaDT
+from eth_utils import to_checksum_address
+from safe_history_rawdata import CACHE_DIR, TxCache     # shared service-history cache
+
+WEI_PER_ETH = Decimal(10**18)
+INFO_TTL = 3600                         # seconds a cached safe_info() stays fresh
+
+def _to_dt64(dates: Sequence[str]) -> np.ndarray:
+    # service timestamps are UTC ISO-8601; the "YYYY-MM-DDTHH:MM:SS" prefix goes
+    # straight through numpy's C parser, one call per column
+    return np.array([d[:19] for d in dates], dtype="datetime64[s]")
 
 class SummaryStats:
     def __init__(self, m: Sequence[float]):
-        self.min = min(m) if m else 0
-        self.max = max(m) if m else 0
-        self.mean = mean(m) if m else 0
-        self.median = median(m) if m else 0
-        self.stdev = stdev(m) if len(m) > 1 else 0
+        arr = np.asarray(m, dtype=np.float64)
+        self.min = float(arr.min()) if arr.size else 0
+        self.max = float(arr.max()) if arr.size else 0
+        self.mean = float(arr.mean()) if arr.size else 0
+        self.median = float(np.median(arr)) if arr.size else 0
+        self.stdev = float(arr.std(ddof=1)) if arr.size > 1 else 0
 
 class SafeSignerStats:
-    def __init__(self, a: str):
+    def __init__(self, a: str, c: int = 0, s: int = 0, e: int = 0, g: int = 0,
+                 t: Sequence[float] = ()):
         self.a = a              # address
-        self.c = 0              # created
-        self.s = 0              # signed
-        self.e = 0              # executed
-        self.g = Decimal(0)     # gas eth
-        self._t: List[float] = []  # signing times in minutes
-    def rc(self):
-        self.c += 1
-    def rs(self):
-        self.s += 1
-    def re(self):
-        self.e += 1
-    def ag(self, w: int):
-        self.g += from_wei(w, "ether")
-    def at(self, c: MayaDT, s: MayaDT):
-        self._t.append((s - c).seconds / 60)
+        self.c = c              # created
+        self.s = s              # signed
+        self.e = e              # executed
+        self.g = g              # gas wei
+        self._t: List[float] = list(t)  # signing times in minutes
     def stats(self) -> SummaryStats:
         return SummaryStats(self._t)
 
 class SafeStatsTransactionServiceApi(TransactionServiceApi):
     TX_LIMIT = 100
-    def get_all_transactions(self, sa: str) -> List[Dict[str, Any]]:
+    MAX_WORKERS = 8
+
+    def _get_page(self, url: str) -> Dict[str, Any]:
+        r = self._get_request(url)
+        if not r.ok:
+            raise RuntimeError(r.text)
+        return json_loads(r.content)
+
+    def get_all_transactions(self, sa: str, nonce_gte: Optional[int] = None) -> List[Dict[str, Any]]:
         base = f"/api/v1/safes/{sa}/multisig-transactions?limit={self.TX_LIMIT}"
-        nonce = None
-        out: List[Dict[str, Any]] = []
-        while True:
-            url = base + (f"&nonce__lt={nonce}" if nonce is not None else "")
-            r = self._get_request(url)
-            if not r.ok:
-                raise RuntimeError(r.text)
-            page = r.json().get("results", [])
+        if nonce_gte is not None:
+            base += f"&nonce__gte={nonce_gte}"
+        first = self._get_page(base)
+        out: List[Dict[str, Any]] = list(first.get("results", []))
+        count = first.get("count")
+        if count is None:
+            return self._get_remaining_by_nonce(base, out)
+
+        # every offset is known from `count`, so fetch the remaining pages concurrently
+        urls = [f"{base}&offset={n * self.TX_LIMIT}" for n in range(1, math.ceil(count / self.TX_LIMIT))]
+        with ThreadPoolExecutor(max_workers=self.MAX_WORKERS) as ex:
+            for page in ex.map(self._get_page, urls):
+                out.extend(page.get("results", []))
+        out.sort(key=lambda x: x["nonce"], reverse=True)
+        return out
+
+    def _get_remaining_by_nonce(self, base: str, out: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        # fallback for services that don't report `count`: walk pages via nonce__lt
+        page = out
+        while len(page) == self.TX_LIMIT:
+            nonce = min(page, key=lambda x: x["nonce"])["nonce"]
+            page = self._get_page(base + f"&nonce__lt={nonce}").get("results", [])
             out.extend(page)
-            if len(page) == self.TX_LIMIT:
-                nonce = min(page, key=lambda x: x["nonce"])["nonce"]
-            else:
-                return out
+        return out
+
+@functools.cache
+def safe_info(sa: str, ep: str) -> SimpleNamespace:
+    """address / version / threshold / owners of the Safe, from disk if fetched within INFO_TTL."""
+    # endpoint digest in the name: the same Safe address can exist on several chains
+    path = CACHE_DIR / f"info-{to_checksum_address(sa)}-{hashlib.sha1(ep.encode()).hexdigest()[:8]}.json"
+    if path.exists() and time.time() - path.stat().st_mtime < INFO_TTL:
+        try:
+            return SimpleNamespace(**json_loads(path.read_bytes()))
+        except (ValueError, TypeError):     # unreadable / truncated – refetch below
+            pass
+
+    info = Safe(address=sa, ethereum_client=EthereumClient(ep)).retrieve_all_info()
+    fields = {"address": info.address, "version": info.version,
+              "threshold": info.threshold, "owners": list(info.owners)}
+    CACHE_DIR.mkdir(parents=True, exist_ok=True)
+    blob = json_dumps(fields)
+    tmp = path.with_suffix(f".{os.getpid()}.tmp")
+    tmp.write_bytes(blob if isinstance(blob, bytes) else blob.encode())
+    os.replace(tmp, path)               # atomic: readers never see a partial file
+    return SimpleNamespace(**fields)
 
 def print_safe_stats(sa: str, ep: str, fb: int = 0) -> None:
     ec = EthereumClient(ep)
-    safe = Safe(address=sa, ethereum_client=ec)
-    info = safe.retrieve_all_info()
+    info = safe_info(sa, ep)
+    owners = frozenset(info.owners)     # membership tests; info.owners keeps print order
 
     bar = "=" * 55
     print(bar)
@@ -86,60 +138,72 @@ def print_safe_stats(sa: str, ep: str, fb: int = 0) -> None:
 
     # ---- Fetch transactions ----
     api = SafeStatsTransactionServiceApi.from_ethereum_client(ec)
-    all_txs = api.get_all_transactions(sa)
-    executed = [t for t in all_txs if t["isExecuted"] and t["isSuccessful"] and t["blockNumber"] >= fb]
+    cache = TxCache(api.network.name.lower(), info.address)
+    since = cache.resume_nonce()
+    txs = cache.sync(api.get_all_transactions(sa, since), since)
+    executed = [t for t in txs if t["isExecuted"] and t["isSuccessful"] and t["blockNumber"] >= fb]
 
     print("\n** TRANSACTION INFO **\n")
     print(f"Num Executed Txs ............. {len(executed)}")
 
     # data holders
     signer_stats: Dict[str, SafeSignerStats] = {}
-    executor_gas: Dict[str, Decimal] = {}
-    executor_count: Dict[str, int] = {}
+    executor_gas: Dict[str, int] = {}     # wei
     non_owner_exec = 0
-    exec_times: List[float] = []
     raw_exec_rows: List[str] = []
 
-    for tx in executed:
-        cd = MayaDT.from_iso8601(tx["submissionDate"])
-        ed = MayaDT.from_iso8601(tx["executionDate"])
-        exec_times.append((ed - cd).seconds / 60)
+    # timings in minutes, parsed and subtracted column-wise
+    n_exec = len(executed)
+    n_confs = np.fromiter((len(tx["confirmations"]) for tx in executed), dtype=np.int64, count=n_exec)
+    subs = _to_dt64([tx["submissionDate"] for tx in executed])
+    exec_times = (_to_dt64([tx["executionDate"] for tx in executed]) - subs).astype(np.int64) / 60
+    conf_subs = _to_dt64([c["submissionDate"] for tx in executed for c in tx["confirmations"]])
+    sign_times = (conf_subs - np.repeat(subs, n_confs)).astype(np.int64) / 60
+
+    # per-signer counts as bincount reductions over integer owner ids;
+    # confirmations are flat (CSR-style), tx i owning conf_idx[indptr[i]:indptr[i + 1]]
+    ids: Dict[str, int] = {}
+    exec_idx = np.fromiter((ids.setdefault(tx["executor"], len(ids)) for tx in executed),
+                           dtype=np.int64, count=n_exec)
+    conf_idx = np.fromiter((ids.setdefault(c["owner"], len(ids)) for tx in executed for c in tx["confirmations"]),
+                           dtype=np.int64, count=int(n_confs.sum()))
+    indptr = np.concatenate(([0], np.cumsum(n_confs)))
+    first = indptr[:-1][n_confs > 0]            # creator = first confirmation of each tx
+    later = np.ones(conf_idx.size, dtype=bool)
+    later[first] = False
+    created = np.bincount(conf_idx[first], minlength=len(ids))
+    signed = np.bincount(conf_idx, minlength=len(ids))
+    execs = np.bincount(exec_idx, minlength=len(ids))
+    # signing delays (creator excluded) grouped by owner id
+    order = np.argsort(conf_idx[later], kind="stable")
+    delays = sign_times[later][order]
+    bounds = np.searchsorted(conf_idx[later][order], np.arange(len(ids) + 1))
 
+    for tx in executed:
         fee_wei = int(tx["fee"])
         executor = tx["executor"]
-        eth_spent = from_wei(fee_wei, "ether")
-        executor_gas[executor] = executor_gas.get(executor, Decimal(0)) + eth_spent
-        executor_count[executor] = executor_count.get(executor, 0) + 1
-
-        # merge executor into signer stats (owner or not)
-        if executor not in signer_stats:
-            signer_stats[executor] = SafeSignerStats(executor)
-        signer_stats[executor].re()
-        signer_stats[executor].ag(fee_wei)
+        executor_gas[executor] = executor_gas.get(executor, 0) + fee_wei
 
-        if executor not in info.owners:
+        if executor not in owners:
             non_owner_exec += 1
 
-        # confirmations → signings & creations
-        for idx, conf in enumerate(tx["confirmations"]):
-            owner = conf["owner"]
-            st = signer_stats.setdefault(owner, SafeSignerStats(owner))
-            st.rs()
-            if idx == 0:
-                st.rc()
-            else:
-                st.at(cd, MayaDT.from_iso8601(conf["submissionDate"]))
-
         # raw row
-        raw_exec_rows.append(f"{tx['safeTxHash']},{tx['blockNumber']},{executor},{eth_spent:.4f}")
+        raw_exec_rows.append(f"{tx['safeTxHash']},{tx['blockNumber']},{executor},{Decimal(fee_wei) / WEI_PER_ETH:.4f}")
+
+    # wrap the columnar results back into per-address stats (owner or not)
+    for addr, i in ids.items():
+        signer_stats[addr] = SafeSignerStats(
+            addr, c=int(created[i]), s=int(signed[i]), e=int(execs[i]),
+            g=executor_gas.get(addr, 0), t=delays[bounds[i]:bounds[i + 1]].tolist(),
+        )
 
     print(f"Non-Signer Executions ........ {non_owner_exec}")
 
     # print executor gas table
     print("Executor Gas Spent (ETH):")
-    for addr, gas in sorted(executor_gas.items(), key=lambda x: (-x[1], x[0])):
-        role = "owner" if addr in info.owners else "non-owner"
-        print(f"  {addr} ({role}) .... {gas:.4f}")
+    for addr, wei in sorted(executor_gas.items(), key=lambda x: (-x[1], x[0])):
+        role = "owner" if addr in owners else "non-owner"
+        print(f"  {addr} ({role}) .... {Decimal(wei) / WEI_PER_ETH:.4f}")
 
     # overall timing stats
     stats = SummaryStats(exec_times)
@@ -152,19 +216,21 @@ def print_safe_stats(sa: str, ep: str, fb: int = 0) -> None:
 
     # ---- Signer (and executor) section ----
     print("\n** SIGNER & EXECUTOR INFO **\n")
+    buf = io.StringIO()                 # one stdout write for the whole table
     for addr, st in sorted(signer_stats.items(), key=lambda x: (-x[1].g, x[0])):
-        role = "owner" if addr in info.owners else "relayer"
-        print(f"\tAddress ({role}): {addr}")
-        print(f"\t\tNum Txs Created ............ {st.c} ({st.c/len(executed):.1%})")
-        print(f"\t\tNum Txs Signed ............. {st.s} ({st.s/len(executed):.1%})")
-        print(f"\t\tNum Txs Executed ........... {st.e} ({st.e/len(executed):.1%})")
-        print(f"\t\tGas Spent .................. {st.g:.4f} ETH\n")
+        role = "owner" if addr in owners else "relayer"
+        print(f"\tAddress ({role}): {addr}", file=buf)
+        print(f"\t\tNum Txs Created ............ {st.c} ({st.c/n_exec:.1%})", file=buf)
+        print(f"\t\tNum Txs Signed ............. {st.s} ({st.s/n_exec:.1%})", file=buf)
+        print(f"\t\tNum Txs Executed ........... {st.e} ({st.e/n_exec:.1%})", file=buf)
+        print(f"\t\tGas Spent .................. {Decimal(st.g) / WEI_PER_ETH:.4f} ETH\n", file=buf)
+    sys.stdout.write(buf.getvalue())
 
     # ---- raw csv dump ----
     print("** RAW EXECUTED TXS (csv) **")
     print("txHash,blockNumber,executor,gasSpentEth")
-    for line in raw_exec_rows:
-        print(line)
+    if raw_exec_rows:
+        sys.stdout.write("\n".join(raw_exec_rows) + "\n")
 
 
 def main() -> None: